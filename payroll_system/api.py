@@ -0,0 +1,440 @@
+"""Local HTTP service for attendance terminals.
+
+Biometric terminals post attendance over the network instead of using
+the GUI.  The service is built on :mod:`asyncio` alone so no web
+framework is required.  Every attendance post is handed to a single
+writer task which collects the posts arriving within a short window
+and stores them in one transaction.  SQLite therefore only ever sees
+one writer, which avoids ``database is locked`` errors even when many
+terminals submit at the same time.
+
+Endpoints (JSON in and out):
+
+- ``POST /attendance`` – one record or a list of records.
+- ``GET /employees/<employee_id>`` – basic employee details.
+- ``GET /attendance?start=YYYY-MM-DD&end=YYYY-MM-DD`` – export rows.
+
+When a token is configured every request must send it as
+``Authorization: Bearer <token>``.
+"""
+
+import asyncio
+import hmac
+import ipaddress
+import json
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+
+from .db import SessionLocal, Employee, record_attendance_bulk
+from .export import attendance_records
+
+logger = logging.getLogger(__name__)
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+}
+MAX_BODY = 1024 * 1024
+
+
+class RequestError(Exception):
+    """Raised for client errors that map to an HTTP status."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _amount(item: dict, field: str):
+    """Return ``item[field]`` as a finite float or ``None`` if absent."""
+    value = item.get(field)
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise RequestError(400, f'{field} must be a number')
+    try:
+        value = float(value)
+    except (TypeError, ValueError) as exc:
+        raise RequestError(400, f'{field} must be a number') from exc
+    if not math.isfinite(value):
+        raise RequestError(400, f'{field} must be a finite number')
+    return value
+
+
+def _text(item: dict, field: str):
+    """Return ``item[field]`` as a string or ``None`` if absent or empty."""
+    value = item.get(field)
+    if value is None or value == '':
+        return None
+    if not isinstance(value, str):
+        raise RequestError(400, f'{field} must be a string')
+    return value
+
+
+def parse_attendance(item: dict) -> dict:
+    """Validate one JSON attendance record.
+
+    Parameters
+    ----------
+    item : dict
+        Decoded JSON object with at least ``employee_id``, ``date``,
+        ``salary`` and ``role``.
+
+    Returns
+    -------
+    dict
+        Keyword arguments for :func:`~payroll_system.db.record_attendance`.
+    """
+    if not isinstance(item, dict):
+        raise RequestError(400, 'Attendance record must be an object')
+    for field in ('employee_id', 'date', 'salary', 'role'):
+        if item.get(field) in (None, ''):
+            raise RequestError(400, f'Missing field: {field}')
+    try:
+        date = datetime.fromisoformat(str(item['date']))
+    except ValueError as exc:
+        raise RequestError(400, 'date must be YYYY-MM-DD') from exc
+    is_sunday = item.get('is_sunday')
+    if is_sunday is None:
+        is_sunday = date.weekday() == 6
+    elif not isinstance(is_sunday, bool):
+        raise RequestError(400, 'is_sunday must be true or false')
+    return {
+        'employee_id': str(item['employee_id']),
+        'date': date,
+        'salary': _amount(item, 'salary'),
+        'role': str(item['role']),
+        'is_sunday': is_sunday,
+        'leave_type': _text(item, 'leave_type'),
+        'temporary_salary': _amount(item, 'temporary_salary'),
+        'anomaly_flag': _text(item, 'anomaly_flag'),
+    }
+
+
+class AttendanceBatcher:
+    """Coalesce concurrent attendance posts into batched transactions.
+
+    Parameters
+    ----------
+    max_latency : float, optional
+        Longest time in seconds a post waits for others to join its batch.
+    max_batch : int, optional
+        Number of rows after which a batch is written immediately.
+    session_factory : callable, optional
+        Returns a new SQLAlchemy session. Defaults to ``SessionLocal``.
+    """
+
+    def __init__(self, max_latency: float = 0.05, max_batch: int = 500,
+                 session_factory=SessionLocal):
+        self.max_latency = max_latency
+        self.max_batch = max_batch
+        self.session_factory = session_factory
+        self._queue = None
+        self._task = None
+        # A single thread keeps every write on one SQLite connection
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def start(self):
+        """Start the writer task on the running event loop."""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush pending posts and stop the writer task."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, rows: list[dict]) -> int:
+        """Queue validated rows and wait until they are committed."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((rows, future))
+        return await future
+
+    def _write(self, posts: list[list[dict]]) -> list:
+        """Store a batch of posts, returning a row count or error per post."""
+        results = [None] * len(posts)
+        with self.session_factory() as session:
+            ids = {row['employee_id'] for rows in posts for row in rows}
+            known = {
+                emp_id for (emp_id,) in session.query(Employee.employee_id)
+                .filter(Employee.employee_id.in_(ids))
+            }
+            valid = []
+            for i, rows in enumerate(posts):
+                unknown = sorted({row['employee_id'] for row in rows} - known)
+                if unknown:
+                    results[i] = RequestError(404, f'Unknown employee: {unknown[0]}')
+                else:
+                    valid.append(i)
+
+            try:
+                record_attendance_bulk(session, [row for i in valid for row in posts[i]])
+            except Exception:
+                session.rollback()
+                # Retry post by post so one bad post does not fail its neighbours
+                for i in valid:
+                    try:
+                        record_attendance_bulk(session, posts[i])
+                    except Exception as exc:
+                        session.rollback()
+                        logger.exception('Failed to record attendance post')
+                        results[i] = exc
+            for i in valid:
+                if results[i] is None:
+                    results[i] = len(posts[i])
+        return results
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            size = len(item[0])
+            deadline = loop.time() + self.max_latency
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self._write, [rows for rows, _ in batch]
+                )
+            except Exception as exc:  # the database itself is unusable
+                logger.exception('Failed to write attendance batch')
+                results = [exc] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+def lookup_employee(employee_id: str, session_factory=SessionLocal):
+    """Return non-sensitive employee details or ``None`` if unknown."""
+    with session_factory() as session:
+        emp = session.query(Employee).filter_by(employee_id=employee_id).first()
+        if emp is None:
+            return None
+        return {
+            'employee_id': emp.employee_id,
+            'name': emp.name,
+            'contact_number': emp.contact_number,
+            'hire_date': emp.hire_date.isoformat() if emp.hire_date else None,
+            'consent_given': emp.consent_given,
+        }
+
+
+def is_loopback(host: str) -> bool:
+    """Return True if ``host`` only accepts connections from this machine."""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class AttendanceServer:
+    """Minimal HTTP/1.1 server exposing the attendance endpoints.
+
+    Parameters
+    ----------
+    token : str, optional
+        Shared secret every request must send as a bearer token. Required
+        when ``host`` is reachable from other machines.
+    session_factory : callable, optional
+        Returns a new SQLAlchemy session. Defaults to ``SessionLocal``.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8080,
+                 max_latency: float = 0.05, max_batch: int = 500,
+                 token: str | None = None, session_factory=SessionLocal):
+        if not token and not is_loopback(host):
+            raise ValueError('A token is required when serving on a non-loopback address')
+        self.host = host
+        self.port = port
+        self.token = token
+        self.session_factory = session_factory
+        self.batcher = AttendanceBatcher(max_latency, max_batch, session_factory)
+        self._server = None
+
+    async def start(self):
+        """Start the writer task and begin accepting connections."""
+        await self.batcher.start()
+        self._server = await asyncio.start_server(
+            self._handle_client, self.host, self.port
+        )
+        # Report the real port when an ephemeral one (0) was requested
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Close the listening socket and flush pending attendance."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        """Run until cancelled."""
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _readline(self, reader) -> bytes:
+        try:
+            return await reader.readline()
+        except ValueError as exc:  # line longer than the stream limit
+            raise RequestError(431, 'Request header too large') from exc
+
+    async def _read_request(self, reader):
+        """Read one request, returning ``None`` when the client is done."""
+        request_line = await self._readline(reader)
+        if not request_line.strip():
+            return None
+        headers = {}
+        while True:
+            line = await self._readline(reader)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            length = int(headers.get('content-length', 0))
+        except ValueError as exc:
+            raise RequestError(400, 'Malformed request') from exc
+        if length < 0:
+            raise RequestError(400, 'Malformed request')
+        if length > MAX_BODY:
+            raise RequestError(413, 'Request body too large')
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target, headers, body
+
+    def _authorize(self, headers: dict):
+        if not self.token:
+            return
+        scheme, _, supplied = headers.get('authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(
+            supplied.strip().encode(), self.token.encode()
+        ):
+            raise RequestError(401, 'Missing or invalid token')
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                # Stays False until a request was read completely, so the
+                # connection is closed after unreadable requests.
+                keep_alive = False
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                    self._authorize(headers)
+                    status, payload = await self._dispatch(method, target, body)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    raise
+                except RequestError as exc:
+                    status, payload = exc.status, {'error': str(exc)}
+                except Exception:
+                    logger.exception('Unhandled error in attendance API')
+                    status, payload = 500, {'error': 'Internal server error'}
+
+                data = json.dumps(payload, default=str).encode()
+                writer.write(
+                    f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                    'Content-Type: application/json\r\n'
+                    f'Content-Length: {len(data)}\r\n'
+                    f'Connection: {"keep-alive" if keep_alive else "close"}\r\n'
+                    '\r\n'.encode() + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, target: str, body: bytes):
+        url = urlsplit(target)
+        parts = [p for p in url.path.split('/') if p]
+        loop = asyncio.get_running_loop()
+
+        if parts == ['attendance'] and method == 'POST':
+            try:
+                data = json.loads(body or b'null')
+            except json.JSONDecodeError as exc:
+                raise RequestError(400, f'Invalid JSON: {exc}') from exc
+            items = data if isinstance(data, list) else [data]
+            rows = [parse_attendance(item) for item in items]
+            recorded = await self.batcher.submit(rows) if rows else 0
+            return 200, {'recorded': recorded}
+
+        if parts == ['attendance'] and method == 'GET':
+            query = parse_qs(url.query)
+            try:
+                start = datetime.fromisoformat(query['start'][0])
+                end = datetime.fromisoformat(query['end'][0])
+            except (KeyError, ValueError) as exc:
+                raise RequestError(400, 'start and end must be YYYY-MM-DD') from exc
+            rows = await loop.run_in_executor(
+                None, attendance_records, start, end, self.session_factory
+            )
+            return 200, rows
+
+        if len(parts) == 2 and parts[0] == 'employees' and method == 'GET':
+            emp = await loop.run_in_executor(
+                None, lookup_employee, parts[1], self.session_factory
+            )
+            if emp is None:
+                raise RequestError(404, f'Unknown employee: {parts[1]}')
+            return 200, emp
+
+        if parts and parts[0] in {'attendance', 'employees'}:
+            raise RequestError(405, f'{method} not allowed')
+        raise RequestError(404, f'No route for {url.path}')
+
+
+def run_server(host: str = '127.0.0.1', port: int = 8080,
+               max_latency: float = 0.05, max_batch: int = 500,
+               token: str | None = None):
+    """Run the attendance HTTP service until interrupted."""
+    server = AttendanceServer(host, port, max_latency, max_batch, token)
+    print(f'Serving attendance API on http://{host}:{port}')
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -7,20 +7,23 @@ encrypted with Fernet for demonstration purposes.
 
 import os
 import json
+import logging
 from zipfile import ZipFile
 from datetime import datetime
 from uuid import uuid4
 from cryptography.fernet import Fernet
 from sqlalchemy import (
     create_engine, Column, String, Integer, Float, Boolean,
-    DateTime, JSON, ForeignKey, Index
+    DateTime, JSON, ForeignKey, Index, func, select, inspect, text, or_
 )
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 DB_NAME = os.environ.get('PAYROLL_DB', 'employee_db_2025.sqlite')
 Base = declarative_base()
 engine = create_engine(f'sqlite:///{DB_NAME}', echo=False, future=True)
 SessionLocal = sessionmaker(bind=engine)
+logger = logging.getLogger(__name__)
 
 # Simple key management for demo purposes
 # ``secret.key`` is created automatically on first run so that encrypted
@@ -57,15 +60,21 @@ class Employee(Base):
     address_proof = Column(String)
     photo = Column(String)
     hire_date = Column(DateTime)
+    # salary_history and custom_fields mirror the SalaryHistory and
+    # EmployeeAttribute tables, which should be used for queries.
     salary_history = Column(JSON, default={})
     consent_given = Column(Boolean, default=False)
     custom_fields = Column(JSON, default={})
+    change_seq = Column(Integer, index=True)
 
 
 class Attendance(Base):
-    """Daily attendance records."""
+    """Daily attendance records, at most one per employee and date."""
 
     __tablename__ = 'attendance'
+    __table_args__ = (
+        Index('ux_attendance_employee_date', 'employee_id', 'date', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     employee_id = Column(String, ForeignKey('employees.employee_id'), index=True)
@@ -76,6 +85,49 @@ class Attendance(Base):
     leave_type = Column(String)
     temporary_salary = Column(Float)
     anomaly_flag = Column(String)
+    change_seq = Column(Integer, index=True)
+
+
+class SalaryHistory(Base):
+    """Salary changes for an employee, one row per effective date."""
+
+    __tablename__ = 'salary_history'
+    __table_args__ = (
+        Index('ux_salary_history_employee_date', 'employee_id', 'effective_date', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    employee_id = Column(String, ForeignKey('employees.employee_id'), nullable=False)
+    effective_date = Column(DateTime, nullable=False)
+    amount = Column(Float, nullable=False)
+
+
+class EmployeeAttribute(Base):
+    """Custom key/value attributes for an employee."""
+
+    __tablename__ = 'employee_attributes'
+    __table_args__ = (
+        Index('ix_employee_attributes_key_value', 'key', 'value'),
+        Index('ix_employee_attributes_employee_key', 'employee_id', 'key', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    employee_id = Column(String, ForeignKey('employees.employee_id'), nullable=False)
+    key = Column(String, nullable=False)
+    value = Column(String)
+
+
+class DeletedAttendance(Base):
+    """Tombstones for removed attendance rows, written by a trigger."""
+
+    __tablename__ = 'deleted_attendance'
+
+    id = Column(Integer, primary_key=True)
+    attendance_id = Column(Integer)
+    employee_id = Column(String)
+    date = Column(DateTime)
+    deletion_date = Column(DateTime, default=datetime.utcnow)
+    change_seq = Column(Integer, index=True)
 
 
 class DeletedEmployee(Base):
@@ -90,6 +142,7 @@ class DeletedEmployee(Base):
     deletion_reason = Column(String)
     deletion_details = Column(String)
     deleted_by = Column(String)
+    change_seq = Column(Integer, index=True)
 
 
 class AuditLog(Base):
@@ -104,6 +157,19 @@ class AuditLog(Base):
     details = Column(String)
 
 
+class ChangeCounter(Base):
+    """Single-row counter handing out change sequence numbers.
+
+    SQLite triggers stamp every insert or update of the tracked tables
+    with the next value so incremental exports can resume from a cursor.
+    """
+
+    __tablename__ = 'change_counter'
+
+    id = Column(Integer, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+
 class Metadata(Base):
     """Schema versioning information."""
 
@@ -140,15 +206,245 @@ def decrypt(value: str) -> str:
     return fernet.decrypt(value.encode()).decode()
 
 
+def _attribute_value(value) -> str:
+    """Store strings as-is and anything else as JSON text."""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def _load_json(value, employee_id: str, column: str):
+    """Decode a JSON column stored as text, or ``None`` if it is invalid."""
+    if not isinstance(value, str):
+        return value
+    try:
+        return json.loads(value or '{}')
+    except ValueError:
+        logger.warning('Skipping unreadable %s for employee %s', column, employee_id)
+        return None
+
+
+def _parse_date(value):
+    """Return ``value`` as a ``datetime`` or ``None`` if it is not ISO formatted."""
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def _salary_entry(entry) -> tuple:
+    """Return ``(date, amount)`` from a list-style ``salary_history`` entry."""
+    if not isinstance(entry, dict):
+        return None, entry
+    return (entry.get('effective_date', entry.get('date')),
+            entry.get('amount', entry.get('salary')))
+
+
+def _salary_rows(employee_id: str, history) -> list[dict]:
+    """Flatten a ``salary_history`` JSON value into table rows.
+
+    Both ``{"2024-04-01": 12000}`` mappings and lists of
+    ``{"date": ..., "salary": ...}`` objects are understood. Entries that
+    cannot be parsed are logged and skipped; for repeated dates the last
+    entry wins.
+    """
+    history = _load_json(history, employee_id, 'salary_history')
+    if isinstance(history, dict):
+        items = history.items()
+    elif isinstance(history, list):
+        items = (_salary_entry(entry) for entry in history)
+    else:
+        items = ()
+    rows = {}
+    for date, amount in items:
+        effective_date = _parse_date(date)
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            effective_date = None
+        if effective_date is None:
+            logger.warning(
+                'Skipping salary entry %r: %r for employee %s', date, amount, employee_id
+            )
+            continue
+        rows[effective_date] = {
+            'employee_id': employee_id, 'effective_date': effective_date, 'amount': amount,
+        }
+    return list(rows.values())
+
+
+def _attribute_rows(employee_id: str, fields) -> list[dict]:
+    """Flatten a ``custom_fields`` JSON value into table rows."""
+    fields = _load_json(fields, employee_id, 'custom_fields')
+    if not isinstance(fields, dict):
+        return []
+    return [
+        {'employee_id': employee_id, 'key': str(key), 'value': _attribute_value(value)}
+        for key, value in fields.items()
+    ]
+
+
+def _migrate_1_1(session):
+    """Backfill salary history and custom fields from the JSON columns."""
+    salary_rows, attribute_rows = [], []
+    # Read the raw text so _load_json can skip cells that are not valid JSON
+    for emp_id, history, fields in session.execute(text(
+        'SELECT employee_id, salary_history, custom_fields FROM employees'
+    )):
+        salary_rows.extend(_salary_rows(emp_id, history))
+        attribute_rows.extend(_attribute_rows(emp_id, fields))
+    session.query(SalaryHistory).delete()
+    session.query(EmployeeAttribute).delete()
+    if salary_rows:
+        session.execute(SalaryHistory.__table__.insert(), salary_rows)
+    if attribute_rows:
+        session.execute(EmployeeAttribute.__table__.insert(), attribute_rows)
+
+
+# Tables whose rows carry a ``change_seq`` column maintained by triggers
+CHANGE_TRACKED_TABLES = [
+    'employees', 'attendance', 'deleted_employees', 'deleted_attendance',
+]
+
+
+def _install_change_tracking(session):
+    """Create the change counter row and triggers if they are missing."""
+    session.execute(text(
+        'INSERT OR IGNORE INTO change_counter (id, value) VALUES (1, 0)'
+    ))
+    for table in CHANGE_TRACKED_TABLES:
+        # The guard stops the insert trigger's own stamping UPDATE from
+        # firing the update trigger and consuming a second number.
+        for event, guard in (('INSERT', ''),
+                             ('UPDATE', 'WHEN NEW.change_seq IS OLD.change_seq')):
+            session.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_change_{event.lower()}
+                AFTER {event} ON {table} {guard}
+                BEGIN
+                    UPDATE change_counter SET value = value + 1 WHERE id = 1;
+                    UPDATE {table}
+                       SET change_seq = (SELECT value FROM change_counter WHERE id = 1)
+                     WHERE rowid = NEW.rowid;
+                END
+            """))
+    # Removed attendance rows become tombstones for incremental exports
+    session.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS trg_attendance_tombstone
+        AFTER DELETE ON attendance
+        BEGIN
+            INSERT INTO deleted_attendance (attendance_id, employee_id, date, deletion_date)
+            VALUES (OLD.id, OLD.employee_id, OLD.date,
+                    strftime('%Y-%m-%d %H:%M:%S', 'now') || '.000000');
+        END
+    """))
+
+
+def _migrate_1_2(session):
+    """Add ``change_seq`` columns and number the existing rows."""
+    inspector = inspect(session.connection())
+    offset = 0
+    for table in CHANGE_TRACKED_TABLES:
+        columns = {col['name'] for col in inspector.get_columns(table)}
+        if 'change_seq' not in columns:
+            session.execute(text(f'ALTER TABLE {table} ADD COLUMN change_seq INTEGER'))
+        session.execute(text(
+            f'CREATE INDEX IF NOT EXISTS ix_{table}_change_seq ON {table} (change_seq)'
+        ))
+        session.execute(
+            text(f'UPDATE {table} SET change_seq = rowid + :offset'), {'offset': offset}
+        )
+        offset += session.execute(
+            text(f'SELECT COALESCE(MAX(rowid), 0) FROM {table}')
+        ).scalar()
+    session.execute(text(
+        'INSERT OR REPLACE INTO change_counter (id, value) VALUES (1, :value)'
+    ), {'value': offset})
+    _install_change_tracking(session)
+
+
+def _migrate_1_3(session):
+    """Keep one attendance row per employee and calendar day.
+
+    The most recently inserted row of each day is kept and moved to
+    midnight, matching :func:`record_attendance_bulk`. Removed rows are
+    recorded in ``deleted_attendance`` so incremental exports emit
+    tombstones for them.
+    """
+    _install_change_tracking(session)
+    unparsed = session.execute(text(
+        'SELECT id FROM attendance WHERE date IS NOT NULL AND date(date) IS NULL'
+    )).scalars().all()
+    if unparsed:
+        logger.warning(
+            'Leaving %d attendance rows with unreadable dates untouched: ids %s',
+            len(unparsed), unparsed,
+        )
+    # Rows whose date SQLite cannot read are never grouped or deleted
+    session.execute(text("""
+        DELETE FROM attendance
+         WHERE employee_id IS NOT NULL AND date(date) IS NOT NULL
+           AND id NOT IN (
+               SELECT MAX(id) FROM attendance
+                WHERE date(date) IS NOT NULL
+                GROUP BY employee_id, date(date)
+           )
+    """))
+    session.execute(text("""
+        UPDATE attendance
+           SET date = date(date) || ' 00:00:00.000000'
+         WHERE date IS NOT NULL AND date != date(date) || ' 00:00:00.000000'
+    """))
+    session.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_attendance_employee_date '
+        'ON attendance (employee_id, date)'
+    ))
+
+
+# Ordered schema upgrades applied by :func:`init_db`. Each step runs once
+# when the stored version is older than its own.
+MIGRATIONS = [
+    ('1.1', _migrate_1_1),
+    ('1.2', _migrate_1_2),
+    ('1.3', _migrate_1_3),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _version_key(version: str) -> tuple:
+    return tuple(int(part) for part in version.split('.'))
+
+
+def upgrade_schema(session):
+    """Apply pending :data:`MIGRATIONS` to the database behind ``session``."""
+    meta = session.query(Metadata).first()
+    if not meta:
+        # A fresh database already has the current schema
+        session.add(
+            Metadata(version_id=SCHEMA_VERSION, last_updated=datetime.utcnow())
+        )
+        _install_change_tracking(session)
+        session.commit()
+        return
+    current = meta.version_id
+    for version, migrate in MIGRATIONS:
+        if _version_key(version) <= _version_key(current):
+            continue
+        migrate(session)
+        session.delete(meta)
+        session.flush()
+        meta = Metadata(version_id=version, last_updated=datetime.utcnow())
+        session.add(meta)
+        session.commit()
+        current = version
+
+
 def init_db():
-    """Create database tables and insert initial metadata if missing."""
+    """Create database tables, insert metadata and apply pending migrations."""
     Base.metadata.create_all(engine)
     with SessionLocal() as session:
-        if not session.query(Metadata).first():
-            session.add(
-                Metadata(version_id='1.0', last_updated=datetime.utcnow())
-            )
-            session.commit()
+        upgrade_schema(session)
 
 
 def add_employee(session, **kwargs):
@@ -184,6 +480,13 @@ def add_employee(session, **kwargs):
             kwargs[field] = encrypt(kwargs[field])
     employee = Employee(**kwargs)
     session.add(employee)
+    session.flush()
+    salary_rows = _salary_rows(employee.employee_id, kwargs.get('salary_history'))
+    if salary_rows:
+        session.execute(SalaryHistory.__table__.insert(), salary_rows)
+    attribute_rows = _attribute_rows(employee.employee_id, kwargs.get('custom_fields'))
+    if attribute_rows:
+        session.execute(EmployeeAttribute.__table__.insert(), attribute_rows)
     session.commit()
     return employee.employee_id
 
@@ -203,6 +506,116 @@ def get_employee(session, employee_id):
     return emp
 
 
+def _salary_key(effective_date: datetime) -> str:
+    """Format a salary date the way ``salary_history`` JSON stores it."""
+    if effective_date == datetime.combine(effective_date.date(), datetime.min.time()):
+        return effective_date.date().isoformat()
+    return effective_date.isoformat()
+
+
+def record_salary(session, employee_id: str, effective_date: datetime, amount: float):
+    """Set the salary effective from ``effective_date``.
+
+    A second call for the same date replaces the amount. The employee's
+    ``salary_history`` JSON is updated to match.
+    """
+    stmt = sqlite_insert(SalaryHistory.__table__).values(
+        employee_id=employee_id, effective_date=effective_date, amount=amount
+    )
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=['employee_id', 'effective_date'],
+        set_={'amount': stmt.excluded.amount},
+    ))
+    emp = session.get(Employee, employee_id)
+    if emp is not None:
+        history = _load_json(emp.salary_history, employee_id, 'salary_history')
+        if not isinstance(history, (dict, list)):
+            history = {}
+        if isinstance(history, list):
+            history = [
+                entry for entry in history
+                if _parse_date(_salary_entry(entry)[0]) != effective_date
+            ]
+            history.append({'date': _salary_key(effective_date), 'salary': amount})
+        else:
+            history = {k: v for k, v in history.items() if _parse_date(k) != effective_date}
+            history[_salary_key(effective_date)] = amount
+        emp.salary_history = history
+    session.commit()
+
+
+def set_custom_field(session, employee_id: str, key: str, value):
+    """Create or replace a custom attribute for an employee.
+
+    The employee's ``custom_fields`` JSON is updated to match.
+    """
+    attr = session.query(EmployeeAttribute).filter_by(
+        employee_id=employee_id, key=key
+    ).first()
+    if attr is None:
+        attr = EmployeeAttribute(employee_id=employee_id, key=key)
+        session.add(attr)
+    attr.value = _attribute_value(value)
+    emp = session.get(Employee, employee_id)
+    if emp is not None:
+        fields = _load_json(emp.custom_fields, employee_id, 'custom_fields')
+        fields = dict(fields) if isinstance(fields, dict) else {}
+        fields[key] = value
+        emp.custom_fields = fields
+    session.commit()
+
+
+def salary_as_of(as_of: datetime):
+    """Return a subquery of each employee's salary on ``as_of``.
+
+    The subquery has ``employee_id``, ``effective_date`` and ``amount``
+    columns so payroll queries can join it against :class:`Attendance`
+    or :class:`Employee` instead of parsing ``salary_history`` JSON.
+
+    Examples
+    --------
+    >>> sal = salary_as_of(datetime(2024, 12, 31))
+    >>> session.query(Employee.name, sal.c.amount).join(
+    ...     sal, sal.c.employee_id == Employee.employee_id
+    ... ).filter(sal.c.amount > 15000)
+    """
+    latest = (
+        select(
+            SalaryHistory.employee_id,
+            func.max(SalaryHistory.effective_date).label('effective_date'),
+        )
+        .where(SalaryHistory.effective_date <= as_of)
+        .group_by(SalaryHistory.employee_id)
+        .subquery()
+    )
+    return (
+        select(SalaryHistory.employee_id, SalaryHistory.effective_date, SalaryHistory.amount)
+        .join(
+            latest,
+            (SalaryHistory.employee_id == latest.c.employee_id)
+            & (SalaryHistory.effective_date == latest.c.effective_date),
+        )
+        .subquery()
+    )
+
+
+def salaries_as_of(session, as_of: datetime) -> dict:
+    """Return ``{employee_id: amount}`` for every employee with a salary on ``as_of``."""
+    sal = salary_as_of(as_of)
+    return dict(session.execute(select(sal.c.employee_id, sal.c.amount)).all())
+
+
+def employees_with_field(session, key: str, value) -> list:
+    """Return employees whose custom attribute ``key`` equals ``value``."""
+    return (
+        session.query(Employee)
+        .join(EmployeeAttribute, EmployeeAttribute.employee_id == Employee.employee_id)
+        .filter(EmployeeAttribute.key == key,
+                EmployeeAttribute.value == _attribute_value(value))
+        .all()
+    )
+
+
 def log_action(session, user_id: str, action: str, details: str = ''):
     """Record a user action in the audit log."""
     session.add(AuditLog(user_id=user_id, action=action, details=details))
@@ -236,6 +649,29 @@ def restore_database(zip_path: str, work_dir: str = '.') -> str:
         zf.extractall(extract_base)
     return os.path.join(extract_base, DB_NAME)
 
+ATTENDANCE_UPDATE_FIELDS = [
+    'salary', 'role', 'is_sunday', 'leave_type', 'temporary_salary', 'anomaly_flag',
+]
+
+
+def _attendance_upsert():
+    """Build an INSERT that updates the existing row for the same employee/date.
+
+    Unchanged rows are left alone so identical re-imports do not bump
+    their ``change_seq`` and show up again in incremental exports.
+    """
+    table = Attendance.__table__
+    stmt = sqlite_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=['employee_id', 'date'],
+        set_={field: stmt.excluded[field] for field in ATTENDANCE_UPDATE_FIELDS},
+        where=or_(*(
+            table.c[field].is_not(stmt.excluded[field])
+            for field in ATTENDANCE_UPDATE_FIELDS
+        )),
+    )
+
+
 def record_attendance(
     session,
     employee_id: str,
@@ -247,19 +683,65 @@ def record_attendance(
     temporary_salary: float | None = None,
     anomaly_flag: str | None = None,
 ):
-    """Insert a new attendance entry."""
-    record = Attendance(
-        employee_id=employee_id,
-        date=date,
-        salary=salary,
-        role=role,
-        is_sunday=is_sunday,
-        leave_type=leave_type,
-        temporary_salary=temporary_salary,
-        anomaly_flag=anomaly_flag,
-    )
-    session.add(record)
+    """Insert an attendance entry or replace the one for the same day."""
+    record_attendance_bulk(session, [{
+        'employee_id': employee_id,
+        'date': date,
+        'salary': salary,
+        'role': role,
+        'is_sunday': is_sunday,
+        'leave_type': leave_type,
+        'temporary_salary': temporary_salary,
+        'anomaly_flag': anomaly_flag,
+    }])
+
+
+def _attendance_day(value) -> datetime:
+    """Truncate an attendance timestamp to midnight of its day."""
+    if isinstance(value, datetime):
+        value = value.date()
+    return datetime.combine(value, datetime.min.time())
+
+
+def record_attendance_bulk(session, rows) -> int:
+    """Upsert many attendance entries in a single transaction.
+
+    Dates are truncated to midnight, so there is one row per employee
+    and day. Rows for a day that already exists replace the stored
+    values, so re-importing the same period is idempotent and needs no
+    lookup per row.
+
+    Parameters
+    ----------
+    session : Session
+        SQLAlchemy session used for the upsert.
+    rows : list[dict]
+        Keyword arguments accepted by :func:`record_attendance`.
+
+    Returns
+    -------
+    int
+        Number of rows inserted or changed; identical rows are skipped.
+    """
+    if not rows:
+        return 0
+    # executemany needs every row to carry the same keys
+    records = [
+        {
+            'employee_id': row['employee_id'],
+            'date': _attendance_day(row['date']),
+            'salary': row['salary'],
+            'role': row['role'],
+            'is_sunday': row.get('is_sunday', False),
+            'leave_type': row.get('leave_type'),
+            'temporary_salary': row.get('temporary_salary'),
+            'anomaly_flag': row.get('anomaly_flag'),
+        }
+        for row in rows
+    ]
+    result = session.execute(_attendance_upsert(), records)
     session.commit()
+    return result.rowcount
 
 def backup_database(zip_path: str = 'backup.zip'):
     """Create a ZIP archive containing the database and employee files."""
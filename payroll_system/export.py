@@ -3,36 +3,38 @@
 These helpers demonstrate how the database contents can be exported to
 Excel, CSV, or JSON files so that non-technical users can back up or
 analyze the information in common tools like LibreOffice or Excel.
+:func:`export_changes` streams only the rows changed since a cursor so a
+downstream warehouse does not need to reload everything.
 """
 
+import heapq
+import json
 import pandas as pd
 from datetime import datetime
 from pathlib import Path
-from .db import SessionLocal, Attendance, Employee
+from sqlalchemy import inspect, select
+from .db import (
+    SessionLocal, Attendance, Employee, DeletedAttendance, DeletedEmployee, ChangeCounter,
+)
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:  # Parquet output is optional
+    PARQUET_AVAILABLE = False
 
-def export_attendance(start_date, end_date, filename='attendance.xlsx') -> str:
-    """Export attendance records to an Excel file.
+CHANGE_BATCH = 1000
 
-    Parameters
-    ----------
-    start_date, end_date : datetime
-        Boundaries for the export.
-    filename : str, optional
-        Destination path. The suffix determines the output format.
-        Path of the resulting Excel file.
-    Returns
-    -------
-    str
-        Path to the written file.
-        The filename that was written.
-    """
-    with SessionLocal() as session:
+
+def attendance_records(start_date, end_date, session_factory=SessionLocal) -> list[dict]:
+    """Return attendance rows between two dates as plain dictionaries."""
+    with session_factory() as session:
         records = session.query(Attendance).filter(
             Attendance.date >= start_date,
             Attendance.date <= end_date
         ).all()
-        data = [
+        return [
             {
                 'employee_id': r.employee_id,
                 'date': r.date,
@@ -44,7 +46,25 @@ def export_attendance(start_date, end_date, filename='attendance.xlsx') -> str:
             }
             for r in records
         ]
-    df = pd.DataFrame(data)
+
+
+def export_attendance(start_date, end_date, filename='attendance.xlsx') -> str:
+    """Export attendance records to an Excel file.
+
+    Parameters
+    ----------
+    start_date, end_date : datetime
+        Boundaries for the export.
+    filename : str, optional
+        Destination path. The suffix determines the output format.
+        Path of the resulting Excel file.
+    Returns
+    -------
+    str
+        Path to the written file.
+        The filename that was written.
+    """
+    df = pd.DataFrame(attendance_records(start_date, end_date))
     path = Path(filename)
     if path.suffix == '.csv':
         df.to_csv(path, index=False)
@@ -53,3 +73,111 @@ def export_attendance(start_date, end_date, filename='attendance.xlsx') -> str:
     else:
         df.to_excel(path, index=False)
     return str(path)
+
+
+def _plain(value):
+    """Convert database values into JSON friendly types."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _changes(session, model, table: str, op: str, since: int, until: int):
+    """Yield change records for ``model`` ordered by ``change_seq``."""
+    stmt = (
+        select(model.__table__)
+        .where(model.change_seq > since, model.change_seq <= until)
+        .order_by(model.change_seq)
+    )
+    for row in session.execute(stmt).mappings():
+        record = {key: _plain(value) for key, value in row.items() if key != 'change_seq'}
+        yield row['change_seq'], table, op, record
+
+
+def current_cursor(session) -> int:
+    """Return the latest change sequence number handed out.
+
+    Raises
+    ------
+    RuntimeError
+        If the database has not been set up for change tracking.
+    """
+    counter = None
+    if inspect(session.connection()).has_table(ChangeCounter.__tablename__):
+        counter = session.get(ChangeCounter, 1)
+    if counter is None:
+        raise RuntimeError(
+            'Change tracking is not set up for this database; run init_db() first'
+        )
+    return counter.value
+
+
+def iter_changes(session, since: int = 0, until: int | None = None):
+    """Yield ``(change_seq, table, op, record)`` tuples after ``since``.
+
+    Employee and attendance rows are emitted with ``op='upsert'``; rows
+    from ``deleted_employees`` and ``deleted_attendance`` become
+    ``op='delete'`` tombstones keyed by ``employee_id`` and
+    ``attendance_id`` respectively.
+    """
+    if until is None:
+        until = current_cursor(session)
+    return heapq.merge(
+        _changes(session, Employee, 'employees', 'upsert', since, until),
+        _changes(session, Attendance, 'attendance', 'upsert', since, until),
+        _changes(session, DeletedEmployee, 'employees', 'delete', since, until),
+        _changes(session, DeletedAttendance, 'attendance', 'delete', since, until),
+        key=lambda change: change[0],
+    )
+
+
+def export_changes(since: int = 0, filename: str = 'changes.jsonl') -> int:
+    """Write rows changed after cursor ``since`` and return the new cursor.
+
+    Parameters
+    ----------
+    since : int, optional
+        Cursor returned by the previous export. ``0`` exports everything.
+    filename : str, optional
+        Destination path. A ``.parquet`` suffix writes Parquet (requires
+        ``pyarrow``); anything else writes JSON Lines.
+
+    Returns
+    -------
+    int
+        Cursor to pass as ``since`` on the next run.
+    """
+    path = Path(filename)
+    parquet = path.suffix == '.parquet'
+    if parquet and not PARQUET_AVAILABLE:
+        raise ImportError('Parquet export requires the pyarrow package')
+
+    with SessionLocal() as session:
+        # Read the high-water mark first so rows committed during the
+        # export are left for the next run instead of being skipped.
+        until = current_cursor(session)
+        changes = iter_changes(session, since, until)
+        if parquet:
+            schema = pa.schema([
+                ('change_seq', pa.int64()),
+                ('table', pa.string()),
+                ('op', pa.string()),
+                ('record', pa.string()),
+            ])
+            with pq.ParquetWriter(path, schema) as writer:
+                batch = []
+                for seq, table, op, record in changes:
+                    batch.append({'change_seq': seq, 'table': table, 'op': op,
+                                  'record': json.dumps(record)})
+                    if len(batch) >= CHANGE_BATCH:
+                        writer.write_table(pa.Table.from_pylist(batch, schema))
+                        batch = []
+                if batch:
+                    writer.write_table(pa.Table.from_pylist(batch, schema))
+        else:
+            with path.open('w') as f:
+                for seq, table, op, record in changes:
+                    f.write(json.dumps(
+                        {'change_seq': seq, 'table': table, 'op': op, 'record': record}
+                    ) + '\n')
+    return max(until, since)
@@ -6,9 +6,11 @@ remembering many options.
 """
 
 import argparse
+import os
 from .gui import run_gui
 from .db import init_db, backup_database
-from .export import export_attendance
+from .export import export_attendance, export_changes
+from .api import run_server
 
 
 def main():
@@ -17,12 +19,24 @@ def main():
     parser.add_argument('--gui', action='store_true', help='Run GUI')
     parser.add_argument('--backup', help='Create a backup ZIP of the database')
     parser.add_argument('--export', nargs=2, metavar=('START', 'END'), help='Export attendance between two YYYY-MM-DD dates')
+    parser.add_argument('--export-changes-since', type=int, metavar='CURSOR', help='Export rows changed after CURSOR (0 for everything)')
+    parser.add_argument('--changes-file', default='changes.jsonl', help='Output for --export-changes-since (.jsonl or .parquet)')
+    parser.add_argument('--serve', action='store_true', help='Run the attendance HTTP API for terminals')
+    parser.add_argument('--host', default='127.0.0.1', help='Address for --serve (default 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='Port for --serve (default 8080)')
+    parser.add_argument('--token', default=os.environ.get('PAYROLL_API_TOKEN'), help='Shared token terminals send as "Authorization: Bearer <token>" (default $PAYROLL_API_TOKEN)')
+    parser.add_argument('--max-latency', type=float, default=0.05, help='Seconds an attendance post may wait to be batched')
     args = parser.parse_args()
 
     init_db()
 
     if args.gui:
         run_gui()
+    elif args.serve:
+        try:
+            run_server(args.host, args.port, args.max_latency, token=args.token)
+        except ValueError as exc:
+            parser.error(str(exc))
     elif args.backup:
         path = backup_database(args.backup)
         print(f'Backup written to {path}')
@@ -30,6 +44,13 @@ def main():
         start, end = args.export
         file = export_attendance(start, end)
         print(f'Attendance exported to {file}')
+    elif args.export_changes_since is not None:
+        try:
+            cursor = export_changes(args.export_changes_since, args.changes_file)
+        except ImportError as exc:
+            parser.error(str(exc))
+        print(f'Changes exported to {args.changes_file}')
+        print(f'Next cursor: {cursor}')
     else:
         parser.print_help()
 
@@ -1,7 +1,50 @@
 import sys
+import asyncio
+import json
+import time
+import pytest
+from datetime import datetime
 from pathlib import Path
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 from payroll_system.ml_utils import predict_bonus_eligibility, recommend_leave_month
+from payroll_system import api
+from payroll_system.api import (
+    AttendanceBatcher, AttendanceServer, RequestError, parse_attendance,
+)
+from payroll_system.db import (
+    Attendance, Base, DeletedEmployee, Employee, EmployeeAttribute, Metadata,
+    _install_change_tracking, add_employee, employees_with_field, record_attendance,
+    record_attendance_bulk, record_salary, salaries_as_of, set_custom_field,
+    upgrade_schema,
+)
+from payroll_system import export
+from payroll_system.export import iter_changes
+
+
+@pytest.fixture
+def engine():
+    """In-memory database shared by every thread of a test."""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        _install_change_tracking(session)
+        session.commit()
+    return engine
+
+
+@pytest.fixture
+def session(engine):
+    with Session(engine) as session:
+        yield session
+
 
 def test_bonus_eligibility():
     assert predict_bonus_eligibility(300, 0, 2) is True
@@ -39,3 +82,268 @@ def test_add_employee_validation():
             aadhar_number="123456789012",
             pan_number="ABCDE123",
         )
+
+
+def test_parse_attendance():
+    row = parse_attendance(
+        {"employee_id": "e1", "date": "2025-03-02", "salary": "450", "role": "Packer"}
+    )
+    assert row["salary"] == 450.0
+    assert row["is_sunday"] is True
+
+    with pytest.raises(RequestError):
+        parse_attendance({"employee_id": "e1", "date": "2025-03-02"})
+    with pytest.raises(RequestError):
+        parse_attendance(
+            {"employee_id": "e1", "date": "2025-03-03", "salary": 1, "role": "x",
+             "is_sunday": "false"}
+        )
+    with pytest.raises(RequestError):
+        parse_attendance({"employee_id": "e1", "date": "2025-03-03", "salary": "nan", "role": "x"})
+    for field in ("leave_type", "anomaly_flag"):
+        with pytest.raises(RequestError):
+            parse_attendance(
+                {"employee_id": "e1", "date": "2025-03-03", "salary": 1, "role": "x",
+                 field: {"kind": "sick"}}
+            )
+
+
+def test_attendance_batcher(engine, session, monkeypatch):
+    emp_id = add_employee(session, name="Asha")
+    writes = []
+
+    def spy(session, rows):
+        writes.append(len(rows))
+        if any(row["salary"] < 0 for row in rows):
+            raise ValueError("rejected by database")
+        return record_attendance_bulk(session, rows)
+
+    monkeypatch.setattr(api, "record_attendance_bulk", spy)
+
+    def post(day, **extra):
+        item = {"employee_id": emp_id, "date": f"2025-01-{day:02d}", "salary": 400, "role": "Packer"}
+        item.update(extra)
+        return [parse_attendance(item)]
+
+    async def scenario():
+        batcher = AttendanceBatcher(max_latency=0.2, session_factory=lambda: Session(engine))
+        await batcher.start()
+
+        # Posts arriving together are written in one transaction after max_latency
+        started = time.monotonic()
+        assert await asyncio.gather(*(batcher.submit(post(day)) for day in (1, 2, 3))) == [1, 1, 1]
+        assert time.monotonic() - started >= 0.15
+        assert writes == [3]
+
+        # A failing or unknown post does not fail its neighbours
+        good, bad, unknown = await asyncio.gather(
+            batcher.submit(post(4)),
+            batcher.submit(post(5, salary=-1)),
+            batcher.submit(post(6, employee_id="nobody")),
+            return_exceptions=True,
+        )
+        assert good == 1
+        assert isinstance(bad, ValueError)
+        assert isinstance(unknown, RequestError) and unknown.status == 404
+
+        # stop() flushes posts that are still waiting for their batch
+        pending = asyncio.create_task(batcher.submit(post(7)))
+        await asyncio.sleep(0)
+        await batcher.stop()
+        assert pending.result() == 1
+
+    asyncio.run(scenario())
+    assert session.query(Attendance).count() == 5
+
+
+def test_attendance_server_round_trip(engine, session):
+    emp_id = add_employee(session, name="Asha")
+
+    async def request(port, method, path, body=None, token="s3cret", extra=""):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        data = json.dumps(body).encode() if body is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nConnection: close\r\nContent-Length: {len(data)}\r\n"
+        if token:
+            head += f"Authorization: Bearer {token}\r\n"
+        writer.write((head + extra + "\r\n").encode() + data)
+        response = await reader.read()
+        writer.close()
+        status_line, _, payload = response.partition(b"\r\n\r\n")
+        return int(status_line.split()[1]), json.loads(payload)
+
+    async def scenario():
+        server = AttendanceServer(
+            port=0, token="s3cret", max_latency=0.01,
+            session_factory=lambda: Session(engine),
+        )
+        await server.start()
+        try:
+            record = {"employee_id": emp_id, "date": "2025-01-02", "salary": 400, "role": "Packer"}
+            assert await request(server.port, "POST", "/attendance", record) == (200, {"recorded": 1})
+            status, emp = await request(server.port, "GET", f"/employees/{emp_id}")
+            assert status == 200 and emp["name"] == "Asha"
+            status, rows = await request(server.port, "GET", "/attendance?start=2025-01-01&end=2025-01-31")
+            assert status == 200 and len(rows) == 1
+            assert (await request(server.port, "GET", f"/employees/{emp_id}", token=None))[0] == 401
+            assert (await request(server.port, "GET", "/employees/nobody"))[0] == 404
+            assert (await request(server.port, "POST", "/attendance", dict(record, employee_id="nobody")))[0] == 404
+            big_header = "X-Padding: " + "a" * 70000 + "\r\n"
+            assert (await request(server.port, "GET", "/employees/x", extra=big_header))[0] == 431
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(b"POST /attendance HTTP/1.1\r\nContent-Length: -5\r\n\r\n")
+            assert (await reader.read()).split()[1] == b"400"
+            writer.close()
+        finally:
+            await server.stop()
+
+    asyncio.run(scenario())
+
+
+def test_server_requires_token_off_loopback():
+    with pytest.raises(ValueError):
+        AttendanceServer(host="0.0.0.0")
+
+
+def test_salaries_as_of(session):
+    emp_id = add_employee(
+        session,
+        name="Asha",
+        salary_history={"2023-04-01": 10000, "2024-04-01": 16000},
+    )
+    assert salaries_as_of(session, datetime(2024, 1, 1)) == {emp_id: 10000.0}
+    assert salaries_as_of(session, datetime(2024, 12, 31)) == {emp_id: 16000.0}
+    assert salaries_as_of(session, datetime(2022, 1, 1)) == {}
+
+
+def test_record_salary_replaces_same_date(session):
+    emp_id = add_employee(session, name="Asha", salary_history={"2024-04-01": 16000})
+    record_salary(session, emp_id, datetime(2024, 4, 1), 17000)
+    record_salary(session, emp_id, datetime(2025, 4, 1), 18000)
+    assert salaries_as_of(session, datetime(2024, 12, 31)) == {emp_id: 17000.0}
+
+    set_custom_field(session, emp_id, "dept", "Packing")
+    emp = session.get(Employee, emp_id)
+    assert emp.salary_history == {"2024-04-01": 17000, "2025-04-01": 18000}
+    assert emp.custom_fields == {"dept": "Packing"}
+
+
+def test_backfill_migration_skips_unparseable_json(session):
+    session.execute(Employee.__table__.insert(), [
+        {"employee_id": "a", "name": "A",
+         "salary_history": {"2024": 1000, "2023-04-01": 9000},
+         "custom_fields": {"dept": "Packing"}},
+        {"employee_id": "b", "name": "B",
+         "salary_history": [{"date": "2024-01-01", "salary": 12000}, {"date": "soon"}],
+         "custom_fields": {"dept": "Cutting"}},
+    ])
+    # Malformed text, not just unusable entries
+    session.execute(text(
+        "INSERT INTO employees (employee_id, name, salary_history, custom_fields)"
+        " VALUES ('c', 'C', '{2024: 1000', '{dept')"
+    ))
+    session.add(Metadata(version_id="1.0", last_updated=datetime(2025, 1, 1)))
+    session.commit()
+
+    upgrade_schema(session)
+
+    assert salaries_as_of(session, datetime(2024, 6, 1)) == {"a": 9000.0, "b": 12000.0}
+    assert [e.employee_id for e in employees_with_field(session, "dept", "Packing")] == ["a"]
+    assert session.query(EmployeeAttribute).count() == 2
+
+
+def test_iter_changes_since_cursor(session):
+    emp_id = add_employee(session, name="Asha")
+    cursor = max(seq for seq, *_ in iter_changes(session))
+
+    record_attendance(session, emp_id, datetime(2025, 1, 2), 400, "Packer")
+    session.add(DeletedEmployee(employee_id=emp_id, name="Asha"))
+    session.commit()
+    changes = [(table, op) for _, table, op, _ in iter_changes(session, cursor)]
+    assert changes == [("attendance", "upsert"), ("employees", "delete")]
+
+
+def test_iter_changes_requires_change_tracking():
+    engine = create_engine("sqlite://")
+    with Session(engine) as session:
+        with pytest.raises(RuntimeError):
+            list(iter_changes(session))
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        with pytest.raises(RuntimeError):
+            list(iter_changes(session))
+
+
+def test_export_changes_parquet(engine, session, monkeypatch, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    emp_id = add_employee(session, name="Asha")
+    record_attendance(session, emp_id, datetime(2025, 1, 2), 400, "Packer")
+    monkeypatch.setattr(export, "SessionLocal", lambda: Session(engine))
+
+    path = tmp_path / "changes.parquet"
+    cursor = export.export_changes(0, str(path))
+
+    table = pq.read_table(path).to_pylist()
+    assert [(row["table"], row["op"]) for row in table] == [
+        ("employees", "upsert"), ("attendance", "upsert"),
+    ]
+    assert json.loads(table[1]["record"])["salary"] == 400.0
+    assert cursor == table[-1]["change_seq"]
+
+
+def test_record_attendance_upsert(session):
+    emp_id = add_employee(session, name="Asha")
+    month = [
+        {"employee_id": emp_id, "date": datetime(2025, 1, day), "salary": 400, "role": "Packer"}
+        for day in range(1, 32)
+    ]
+    assert record_attendance_bulk(session, month) == 31
+    assert record_attendance_bulk(session, month) == 0
+    assert session.query(Attendance).count() == 31
+
+    # Timestamps count as the same day
+    record_attendance(session, emp_id, datetime(2025, 1, 2, 9, 30), 450, "Packer")
+    rows = session.query(Attendance).filter_by(date=datetime(2025, 1, 2)).all()
+    assert [r.salary for r in rows] == [450]
+    assert session.query(Attendance).count() == 31
+
+
+def test_dedupe_migration_keeps_newest_row_per_day(session):
+    emp_id = add_employee(session, name="Asha")
+    session.execute(text("DROP INDEX ux_attendance_employee_date"))
+    session.query(Metadata).delete()
+    session.add(Metadata(version_id="1.2", last_updated=datetime(2025, 1, 1)))
+    session.execute(Attendance.__table__.insert(), [
+        {"employee_id": emp_id, "date": datetime(2025, 1, 1), "salary": 1, "role": "Packer"},
+        {"employee_id": emp_id, "date": datetime(2025, 1, 1, 8), "salary": 2, "role": "Packer"},
+        {"employee_id": emp_id, "date": datetime(2025, 1, 2, 9), "salary": 3, "role": "Packer"},
+    ])
+    for day in ("01/03/2025", "02/03/2025", "03/03/2025"):
+        session.execute(text(
+            "INSERT INTO attendance (employee_id, date, salary, role)"
+            " VALUES (:emp, :day, 5, 'Packer')"
+        ), {"emp": emp_id, "day": day})
+    session.commit()
+    first_id = session.query(Attendance.id).filter_by(salary=1).scalar()
+    cursor = export.current_cursor(session)
+
+    upgrade_schema(session)
+
+    rows = (
+        session.query(Attendance.date, Attendance.salary)
+        .filter(Attendance.salary < 5).order_by(Attendance.date).all()
+    )
+    assert rows == [(datetime(2025, 1, 1), 2.0), (datetime(2025, 1, 2), 3.0)]
+    # Rows with dates SQLite cannot read are left alone
+    unreadable = session.execute(text(
+        "SELECT date FROM attendance WHERE salary = 5 ORDER BY id"
+    )).scalars().all()
+    assert unreadable == ["01/03/2025", "02/03/2025", "03/03/2025"]
+    deletes = [
+        record for _, table, op, record in iter_changes(session, cursor)
+        if (table, op) == ("attendance", "delete")
+    ]
+    assert [d["attendance_id"] for d in deletes] == [first_id]
+    with pytest.raises(IntegrityError):
+        session.execute(Attendance.__table__.insert(), [
+            {"employee_id": emp_id, "date": datetime(2025, 1, 2), "salary": 4, "role": "Packer"},
+        ])